@@ -26,6 +26,7 @@
 
 //Maya headers
 #include <maya/MPxLocatorNode.h>
+#include <maya/MPxCommand.h>
 #include <maya/MFnPlugin.h>
 #include <maya/MFnTransform.h>
 #include <maya/MMatrix.h>
@@ -36,6 +37,11 @@
 #include <maya/MDagPath.h>
 #include <maya/MNodeMessage.h>
 #include <maya/MSceneMessage.h>
+#include <maya/MArgDatabase.h>
+#include <maya/MDGModifier.h>
+#include <maya/MFnDependencyNode.h>
+#include <maya/MSelectionList.h>
+#include <maya/MSyntax.h>
 
 
 //We use a locator node to deal with creating and filtering hydra primitives as an example.
@@ -45,6 +51,10 @@
 createNode("FlowViewportAPIMayaLocator")
 */
 
+/*To set several cube grid parameters at once, please use the following MEL command :
+flowViewportSetCubeParams -nx 30 -ny 30 -nz 30 -c 0 0.5 1 -op 0.3 "FlowViewportAPIMayaLocatorShape1"
+*/
+
 PXR_NAMESPACE_USING_DIRECTIVE
 
 ///Maya Locator node subclass to create filtering and data producer scene indices example, to be used with the flow viewport API.
@@ -85,6 +95,8 @@ public:
     
     ///3D Grid of cube mesh primitives creation parameters for the data producer scene index
     Fvp::DataProducerSceneIndexExample::CubeGridCreationParams  _cubeGridParams;
+    ///When true, attribute changes only update _cubeGridParams and the cube grid is not rebuilt, used to set several parameters at once
+    bool                                                        _deferCubeGridUpdates = false;
     ///_hydraViewportDataProducerSceneIndexExample is what will inject the 3D grid of Hydra cube mesh primitives into the viewport
     Fvp::DataProducerSceneIndexExample                          _hydraViewportDataProducerSceneIndexExample;
 
@@ -239,6 +251,9 @@ namespace
             return; //Not a grid cube attribute
         }
 
+        if (flowViewportAPIMayaLocator->_deferCubeGridUpdates){
+            return; //The cube grid will be updated once all parameters are set
+        }
         
         flowViewportAPIMayaLocator->_hydraViewportDataProducerSceneIndexExample.setCubeGridParams(flowViewportAPIMayaLocator->_cubeGridParams);
     }
@@ -496,6 +511,177 @@ void* FlowViewportAPIMayaLocator::creator()
     return new FlowViewportAPIMayaLocator;
 }
 
+//---------------------------------------------------------------------------
+//---------------------------------------------------------------------------
+// Command to set several cube grid parameters at once
+//---------------------------------------------------------------------------
+//---------------------------------------------------------------------------
+
+///Sets several cube grid parameters of a FlowViewportAPIMayaLocator node in a single undoable DG modification, 
+///so that the 3D grid of Hydra cube mesh primitives is rebuilt only once instead of once per attribute.
+class FlowViewportSetCubeParamsCmd : public MPxCommand
+{
+public:
+    static void*   creator() { return new FlowViewportSetCubeParamsCmd(); }
+    static MSyntax createSyntax();
+
+    static const MString name;
+
+    MStatus doIt(const MArgList& args) override;
+    MStatus redoIt() override;
+    MStatus undoIt() override;
+    bool    isUndoable() const override { return true; }
+
+private:
+    ///Runs the modifier operation with the cube grid updates of the node deferred, then updates the cube grid once
+    MStatus _applyModifier(bool undo);
+
+    MDGModifier _modifier;
+    MObject     _node;
+};
+
+const MString FlowViewportSetCubeParamsCmd::name("flowViewportSetCubeParams");
+
+namespace
+{
+    constexpr auto _numCubesX               = "-nx";
+    constexpr auto _numCubesXLong           = "-numCubesX";
+    constexpr auto _numCubesY               = "-ny";
+    constexpr auto _numCubesYLong           = "-numCubesY";
+    constexpr auto _numCubesZ               = "-nz";
+    constexpr auto _numCubesZLong           = "-numCubesZ";
+    constexpr auto _cubeHalfSize            = "-hs";
+    constexpr auto _cubeHalfSizeLong        = "-cubeHalfSize";
+    constexpr auto _cubeColor               = "-c";
+    constexpr auto _cubeColorLong           = "-cubeColor";
+    constexpr auto _cubeOpacity             = "-op";
+    constexpr auto _cubeOpacityLong         = "-cubeOpacity";
+    constexpr auto _cubesUseInstancing      = "-ui";
+    constexpr auto _cubesUseInstancingLong  = "-cubesUseInstancing";
+    constexpr auto _cubesDeltaTrans         = "-dt";
+    constexpr auto _cubesDeltaTransLong     = "-cubesDeltaTrans";
+
+    void SetDouble3PlugValue(MDGModifier& modifier, const MPlug& plug, const double3& value)
+    {
+        for (unsigned int i = 0; i < 3; ++i){
+            CHECK_MSTATUS(modifier.newPlugValueDouble(plug.child(i), value[i]));
+        }
+    }
+
+    FlowViewportAPIMayaLocator* GetFlowViewportAPIMayaLocator(const MObject& node)
+    {
+        MFnDependencyNode depNode(node);
+        if (depNode.typeId() != FlowViewportAPIMayaLocator::id){
+            return nullptr;
+        }
+        return static_cast<FlowViewportAPIMayaLocator*>(depNode.userNode());
+    }
+}//end of anonymous namespace
+
+MSyntax FlowViewportSetCubeParamsCmd::createSyntax()
+{
+    MSyntax syntax;
+
+    syntax.addFlag(_numCubesX, _numCubesXLong, MSyntax::kLong);
+    syntax.addFlag(_numCubesY, _numCubesYLong, MSyntax::kLong);
+    syntax.addFlag(_numCubesZ, _numCubesZLong, MSyntax::kLong);
+    syntax.addFlag(_cubeHalfSize, _cubeHalfSizeLong, MSyntax::kDouble);
+    syntax.addFlag(_cubeColor, _cubeColorLong, MSyntax::kDouble, MSyntax::kDouble, MSyntax::kDouble);
+    syntax.addFlag(_cubeOpacity, _cubeOpacityLong, MSyntax::kDouble);
+    syntax.addFlag(_cubesUseInstancing, _cubesUseInstancingLong, MSyntax::kBoolean);
+    syntax.addFlag(_cubesDeltaTrans, _cubesDeltaTransLong, MSyntax::kDouble, MSyntax::kDouble, MSyntax::kDouble);
+
+    //The FlowViewportAPIMayaLocator node to modify, the selected one if not given
+    syntax.useSelectionAsDefault(true);
+    syntax.setObjectType(MSyntax::kSelectionList, 1, 1);
+
+    return syntax;
+}
+
+MStatus FlowViewportSetCubeParamsCmd::doIt(const MArgList& args)
+{
+    MStatus status;
+    MArgDatabase argDb(syntax(), args, &status);
+    if (!status) {
+        return status;
+    }
+
+    MSelectionList objects;
+    argDb.getObjects(objects);
+    objects.getDependNode(0, _node);
+    if (!GetFlowViewportAPIMayaLocator(_node)){
+        displayError(name + ": a FlowViewportAPIMayaLocator node is expected.");
+        return MS::kInvalidParameter;
+    }
+
+    const MObject* intAttributes[]  = {&FlowViewportAPIMayaLocator::mNumCubeLevelsX, &FlowViewportAPIMayaLocator::mNumCubeLevelsY, &FlowViewportAPIMayaLocator::mNumCubeLevelsZ};
+    const char* intFlags[]          = {_numCubesX, _numCubesY, _numCubesZ};
+    for (size_t i = 0; i < 3; ++i){
+        if (argDb.isFlagSet(intFlags[i])){
+            int value = 0;
+            argDb.getFlagArgument(intFlags[i], 0, value);
+            CHECK_MSTATUS(_modifier.newPlugValueInt(MPlug(_node, *intAttributes[i]), value));
+        }
+    }
+
+    const MObject* doubleAttributes[]   = {&FlowViewportAPIMayaLocator::mCubeHalfSize, &FlowViewportAPIMayaLocator::mCubeOpacity};
+    const char* doubleFlags[]           = {_cubeHalfSize, _cubeOpacity};
+    for (size_t i = 0; i < 2; ++i){
+        if (argDb.isFlagSet(doubleFlags[i])){
+            double value = 0.0;
+            argDb.getFlagArgument(doubleFlags[i], 0, value);
+            CHECK_MSTATUS(_modifier.newPlugValueDouble(MPlug(_node, *doubleAttributes[i]), value));
+        }
+    }
+
+    const MObject* double3Attributes[]  = {&FlowViewportAPIMayaLocator::mCubeColor, &FlowViewportAPIMayaLocator::mCubesDeltaTrans};
+    const char* double3Flags[]          = {_cubeColor, _cubesDeltaTrans};
+    for (size_t i = 0; i < 2; ++i){
+        if (argDb.isFlagSet(double3Flags[i])){
+            double3 value;
+            for (unsigned int j = 0; j < 3; ++j){
+                argDb.getFlagArgument(double3Flags[i], j, value[j]);
+            }
+            SetDouble3PlugValue(_modifier, MPlug(_node, *double3Attributes[i]), value);
+        }
+    }
+
+    if (argDb.isFlagSet(_cubesUseInstancing)){
+        bool value = false;
+        argDb.getFlagArgument(_cubesUseInstancing, 0, value);
+        CHECK_MSTATUS(_modifier.newPlugValueBool(MPlug(_node, FlowViewportAPIMayaLocator::mCubesUseInstancing), value));
+    }
+
+    return redoIt();
+}
+
+MStatus FlowViewportSetCubeParamsCmd::redoIt()
+{
+    return _applyModifier(false);
+}
+
+MStatus FlowViewportSetCubeParamsCmd::undoIt()
+{
+    return _applyModifier(true);
+}
+
+MStatus FlowViewportSetCubeParamsCmd::_applyModifier(bool undo)
+{
+    FlowViewportAPIMayaLocator* flowViewportAPIMayaLocator = GetFlowViewportAPIMayaLocator(_node);
+    if (!flowViewportAPIMayaLocator){
+        return MS::kFailure;
+    }
+
+    flowViewportAPIMayaLocator->_deferCubeGridUpdates = true;
+    MStatus status = undo ? _modifier.undoIt() : _modifier.doIt();
+    flowViewportAPIMayaLocator->_deferCubeGridUpdates = false;
+    CHECK_MSTATUS(status);
+
+    //Rebuild the cube grid once with all the new parameters
+    flowViewportAPIMayaLocator->SetCubeGridParametersFromAttributes();
+    return status;
+}
+
 //---------------------------------------------------------------------------
 //---------------------------------------------------------------------------
 // Plugin Registration
@@ -590,6 +776,15 @@ MStatus initializePlugin( MObject obj )
         return status;
     }
 
+    status = plugin.registerCommand(
+                FlowViewportSetCubeParamsCmd::name,
+                FlowViewportSetCubeParamsCmd::creator,
+                FlowViewportSetCubeParamsCmd::createSyntax);
+    if (!status) {
+        status.perror("registerCommand");
+        return status;
+    }
+
     return status;
 }
 
@@ -598,6 +793,12 @@ MStatus uninitializePlugin( MObject obj)
     MStatus   status;
     MFnPlugin plugin( obj );
 
+    status = plugin.deregisterCommand( FlowViewportSetCubeParamsCmd::name );
+    if (!status) {
+        status.perror("deregisterCommand");
+        return status;
+    }
+
     status = plugin.deregisterNode( FlowViewportAPIMayaLocator::id );
     if (!status) {
         status.perror("deregisterNode");
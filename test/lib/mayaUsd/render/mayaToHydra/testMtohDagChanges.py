@@ -26,6 +26,7 @@ class TestDagChanges(mtohUtils.MtohTestCase):
     _file = __file__
 
     def setUp(self):
+        super(TestDagChanges, self).setUp()
         self.makeCubeScene()
 
         self.grp1 = cmds.createNode('transform', name='group1')
@@ -26,6 +26,7 @@ class TestVisibility(mtohUtils.MtohTestCase):
     IMAGEDIFF_FAIL_PERCENT = 0.1
 
     def setUp(self):
+        super(TestVisibility, self).setUp()
         self.makeCubeScene(camDist=6)
         self.assertTrue(cmds.getAttr("{}.visibility".format(self.cubeTrans)))
         self.assertTrue(cmds.getAttr("{}.visibility".format(self.cubeShape)))
@@ -14,10 +14,12 @@
 # limitations under the License.
 #
 import os
+import sys
 import maya.cmds as cmds
 import maya.mel
 import mayaUtils
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 KNOWN_FORMATS = {
     'gif': 0,
@@ -40,12 +42,51 @@ def resetDefaultLightIntensity():
         cmds.setAttr('hardwareRenderingGlobals.defaultLightIntensity', 1.0)
 resetDefaultLightIntensity()
 
-def snapshot(outputPath, width=400, height=None, hud=False, grid=False, camera=None):
+# Some environments have locked color policies that prevent changing color policies.
+# Read once, as snapshot() temporarily overrides the variable while playblasting.
+_LOCKED_COLOR_TRANSFORMS = os.environ.get("MAYA_COLOR_MANAGEMENT_POLICY_LOCK") == '1'
+
+# Default snapshot size. Can be lowered with MAYA_HYDRA_TEST_SNAPSHOT_SIZE to make playblasting
+# and image diffing cheaper, provided the reference images were generated at the same size.
+DEFAULT_SNAPSHOT_SIZE = int(os.environ.get("MAYA_HYDRA_TEST_SNAPSHOT_SIZE", 400))
+
+# Raw output transform used for playblasting, resolved on first use.
+_RAW_TRANSFORM = None
+
+def _resolveRawTransform():
+    """Returns the name of the Raw output transform, querying Maya only on the first call."""
+    global _RAW_TRANSFORM
+    if _RAW_TRANSFORM is not None:
+        return _RAW_TRANSFORM
+
+    # Some environments use legacy synColor transforms with 2022 and above.
+    # Find whether the color config should be Raw or Raw legacy
+    # However depending on the MAYA_COLOR_MANAGEMENT_SYNCOLOR env var or the loaded
+    # configs, this may be under a different names. So procedurally find it.
+    colorTransforms = cmds.colorManagementPrefs(q=1, outputTransformNames=True)
+    if "Raw" in colorTransforms:
+        _RAW_TRANSFORM = "Raw"
+    elif "Raw (legacy)" in colorTransforms:
+        _RAW_TRANSFORM = "Raw (legacy)"
+    else:
+        # RAW should be reliably raw-like in most configs, so find the first ending in RAW
+        rawTransforms = [c for c in colorTransforms if c.startswith("Raw ")]
+        if rawTransforms:
+            _RAW_TRANSFORM = rawTransforms[0]
+        else:
+            raise RuntimeError("Could not find Raw color space in available color transforms")
+    return _RAW_TRANSFORM
+
+def snapshot(outputPath, width=None, height=None, hud=False, grid=False, camera=None, frame=None):
     resetDefaultLightIntensity()
     cmds.displayRGBColor('background', 0.36, 0.36, 0.36)
     
+    if width is None:
+        width = DEFAULT_SNAPSHOT_SIZE
     if height is None:
         height = width
+    if frame is None:
+        frame = cmds.currentTime(q=1)
 
     outputExt = os.path.splitext(outputPath)[1].lower().lstrip('.')
 
@@ -68,26 +109,13 @@ def snapshot(outputPath, width=400, height=None, hud=False, grid=False, camera=N
     oldColorTransform = cmds.colorManagementPrefs(q=1, outputTarget="playblast",
                                                   outputTransformName=1)
 
-    # Some environments use legacy synColor transforms with 2022 and above.
-    # Find whether the color config should be Raw or Raw legacy
-    # However depending on the MAYA_COLOR_MANAGEMENT_SYNCOLOR env var or the loaded
-    # configs, this may be under a different names. So procedurally find it.
-    colorTransforms = cmds.colorManagementPrefs(q=1, outputTransformNames=True)
-    if "Raw" in colorTransforms:
-        newColorTransform = "Raw"
-    elif "Raw (legacy)" in colorTransforms:
-        newColorTransform = "Raw (legacy)"
-    else:
-        # RAW should be reliably raw-like in most configs, so find the first ending in RAW
-        newColorTransform = [c for c in colorTransforms if c.startswith("Raw ")]
-        if newColorTransform:
-            newColorTransform = newColorTransform[0]
-        else:
-            raise RuntimeError("Could not find Raw color space in available color transforms")
+    newColorTransform = _resolveRawTransform()
+    # Editing the color management prefs is costly, only do it if the transform needs to change
+    changeColorTransform = oldColorTransform != newColorTransform
 
     # Some environments have locked color policies that prevent changing color policies
     # so we must disable and restore this accordingly.
-    lockedColorTransforms = os.environ.get("MAYA_COLOR_MANAGEMENT_POLICY_LOCK") == '1'
+    lockedColorTransforms = _LOCKED_COLOR_TRANSFORMS and changeColorTransform
     if lockedColorTransforms:
         os.environ['MAYA_COLOR_MANAGEMENT_POLICY_LOCK'] = '0'
 
@@ -106,16 +134,18 @@ def snapshot(outputPath, width=400, height=None, hud=False, grid=False, camera=N
     cmds.headsUpDisplay(layoutVisibility=hud)
     cmds.grid(toggle=grid)
     try:
-        cmds.colorManagementPrefs(e=1, outputTarget="playblast",
-                                  outputTransformName=newColorTransform)
+        if changeColorTransform:
+            cmds.colorManagementPrefs(e=1, outputTarget="playblast",
+                                      outputTransformName=newColorTransform)
         try:
             cmds.refresh()
             cmds.playblast(cf=outputPath, viewer=False, format="image",
-                           frame=cmds.currentTime(q=1), offScreen=1,
+                           frame=frame, offScreen=1,
                            widthHeight=(width, height), percent=100)
         finally:
-            cmds.colorManagementPrefs(e=1, outputTarget="playblast",
-                                      outputTransformName=oldColorTransform)
+            if changeColorTransform:
+                cmds.colorManagementPrefs(e=1, outputTarget="playblast",
+                                          outputTransformName=oldColorTransform)
     finally:
         cmds.setAttr("defaultRenderGlobals.imageFormat", oldFormat)
         cmds.headsUpDisplay(layoutVisibility=oldHud)
@@ -126,9 +156,113 @@ def snapshot(outputPath, width=400, height=None, hud=False, grid=False, camera=N
         if camera:
             cmds.lookThru(panel, oldCamera)
 
+# Environment of the idiff child process, built on first use.
+_IDIFF_ENV = None
+
+def _idiffEnv():
+    """Returns the environment to run idiff with, building it only on the first call."""
+    global _IDIFF_ENV
+    if _IDIFF_ENV is not None:
+        return _IDIFF_ENV
+
+    # LD_LIBRARY_PATH(or PATH or DYLD_LIBRARY_PATH) needs to be set for the idiff executable because its 
+    # RPATH is absolute rather than relative to ORIGIN, meaning the RPATH 
+    # points to the absolute path on the machine where idiff was built.
+    # This absence of relative paths for RPATH comes from OpenImageIO.
+    # We introduce a second workaround to avoid Maya using usd's libpng, 
+    # because both use incompatible versions of libpng. This is done by 
+    # setting LD_LIBRARY_PATH to IDIFF_LD_LIBRARY_PATH only in the environment
+    # of the idiff process, leaving Maya's own environment untouched.
+    env = os.environ.copy()
+    if sys.platform == "darwin":
+        env["DYLD_LIBRARY_PATH"] = os.environ['IDIFF_LD_LIBRARY_PATH']
+    elif sys.platform.startswith("linux"):
+        env["LD_LIBRARY_PATH"] = os.environ['IDIFF_LD_LIBRARY_PATH']
+    _IDIFF_ENV = env
+    return _IDIFF_ENV
+
+# Opt-in to comparing images in process with the OpenImageIO Python module instead of
+# running idiff. This loads OpenImageIO and its libpng into Maya's process, which the
+# idiff workaround above avoids, so only enable it where these libraries don't conflict.
+IN_PROCESS_IMAGE_DIFF = os.environ.get("MAYA_HYDRA_TEST_IN_PROCESS_IMAGE_DIFF") == '1'
+
+# Images read by _compareImages, keyed by path. Only the first image of a comparison,
+# which is the reference image, is kept since snapshots can be overwritten.
+_REFERENCE_IMAGES = {}
+
+def _readImage(imagePath):
+    """Returns the image read from imagePath along with the error message, if any."""
+    import OpenImageIO as oiio
+    image = oiio.ImageBuf(imagePath)
+    # Force reading the pixels now rather than going through OpenImageIO's shared image cache,
+    # which could serve stale pixels for a rewritten snapshot and keep the file open.
+    if not image.read(force=True):
+        return None, image.geterror()
+    return image, ""
+
+def _compareImages(imagePath1, imagePath2, fail, failpercent, hardfail,
+                warn, warnpercent, hardwarn, nthreads):
+    """ Compares the images in process with OpenImageIO, which is what idiff runs under the hood.
+    Returns a completed process instance with the return code idiff would have returned, 
+    its output is a summary rather than idiff's. """
+    import OpenImageIO as oiio
+    args = ['ImageBufAlgo.compare', imagePath1, imagePath2]
+
+    image1 = _REFERENCE_IMAGES.get(imagePath1)
+    if image1 is None:
+        image1, error = _readImage(imagePath1)
+        if image1 is None:
+            return subprocess.CompletedProcess(args, 4, stdout=error.encode())
+        _REFERENCE_IMAGES[imagePath1] = image1
+    image2, error = _readImage(imagePath2)
+    if image2 is None:
+        return subprocess.CompletedProcess(args, 4, stdout=error.encode())
+
+    spec1, spec2 = image1.spec(), image2.spec()
+    if (spec1.width, spec1.height, spec1.nchannels) != (spec2.width, spec2.height, spec2.nchannels):
+        return subprocess.CompletedProcess(args, 3, stdout=b"Images do not match in size")
+
+    # Same defaults as idiff
+    fail = 1.0e-6 if fail is None else fail
+    failpercent = 0 if failpercent is None else failpercent
+    hardfail = float('inf') if hardfail is None else hardfail
+    warn = 1.0e-6 if warn is None else warn
+    warnpercent = 0 if warnpercent is None else warnpercent
+    hardwarn = float('inf') if hardwarn is None else hardwarn
+
+    results = oiio.ImageBufAlgo.compare(image1, image2, fail, warn, nthreads=nthreads)
+    numPixels = spec1.image_pixels()
+    returncode = 0
+    if results.nfail > failpercent / 100.0 * numPixels or results.maxerror > hardfail:
+        returncode = 2
+    elif results.nwarn > warnpercent / 100.0 * numPixels or results.maxerror > hardwarn:
+        returncode = 1
+
+    stdout = ("Mean error = {0}\nMax error = {1}\n{2} pixels ({3:.3f}%) over {4}\n"
+              .format(results.meanerror, results.maxerror, results.nfail,
+                      100.0 * results.nfail / numPixels, fail))
+    return subprocess.CompletedProcess(args, returncode, stdout=stdout.encode())
+
+# idiff command lines without the image paths, keyed by comparison thresholds.
+_IDIFF_ARGS = {}
+
+def _idiffArgs(fail, failpercent, hardfail, warn, warnpercent, hardwarn, perceptual):
+    """Returns the idiff command line without the image paths, building it once per set of thresholds."""
+    key = (fail, failpercent, hardfail, warn, warnpercent, hardwarn, perceptual)
+    args = _IDIFF_ARGS.get(key)
+    if args is None:
+        options = (('-warn', warn), ('-warnpercent', warnpercent), ('-hardwarn', hardwarn),
+                   ('-fail', fail), ('-failpercent', failpercent), ('-hardfail', hardfail))
+        cmdArgs = [arg for flag, value in options if value is not None for arg in (flag, str(value))]
+        if perceptual:
+            cmdArgs.append('-p')
+        args = (os.environ['IMAGE_DIFF_TOOL'], *cmdArgs)
+        _IDIFF_ARGS[key] = args
+    return args
+
 def imageDiff(imagePath1, imagePath2, verbose, fail, failpercent, hardfail, 
-                warn, warnpercent, hardwarn, perceptual):    
-    """ Returns the completed process instance after running idiff.
+                warn, warnpercent, hardwarn, perceptual, nthreads=0):    
+    """ Returns the completed process instance after running idiff, or an equivalent one.
     
     imagePath1   -- First image to compare.
     imagePath2   -- Second image to compare.
@@ -144,6 +278,8 @@ def imageDiff(imagePath1, imagePath2, verbose, fail, failpercent, hardfail,
     perceptual   -- Performs an additional test to see if two images are visually different.
                     If enabled, test overall will fail if more than the "fail percentage" failed 
                     the perceptual test.
+    nthreads     -- Number of threads of an in process comparison, 0 uses OpenImageIO's global
+                    thread count. Use 1 when running several comparisons concurrently.
     
     By default, if any pixels differ between the images, the comparison will fail.
     If, for example, we set fail=0.004, failpercent=10 and hardfail=0.25, the comparison will 
@@ -151,56 +287,82 @@ def imageDiff(imagePath1, imagePath2, verbose, fail, failpercent, hardfail,
     0.25 (just above a 1/255 threshold).
      
     For more information, see https://github.com/OpenImageIO/oiio/blob/cb6475c0dd72b9c49d862d98c6cd2da4509d5f37/src/doc/idiff.rst#L1
+
+    If MAYA_HYDRA_TEST_IN_PROCESS_IMAGE_DIFF is set to 1, the comparison is done in process with 
+    the OpenImageIO Python module using the same criteria instead, except for the perceptual test 
+    which always runs idiff.
     """
-    import platform
+    if IN_PROCESS_IMAGE_DIFF and not perceptual:
+        if verbose:
+            sys.__stdout__.write("\nimage diffing {0} and {1} in process".format(imagePath1, imagePath2))
+            sys.__stdout__.flush()
+        return _compareImages(imagePath1, imagePath2, fail, failpercent, hardfail,
+                              warn, warnpercent, hardwarn, nthreads)
 
-    imageDiff = os.environ['IMAGE_DIFF_TOOL']
-    
-    cmdArgs = []
-    if warn is not None:
-        cmdArgs.extend(['-warn', str(warn)])
-    if warnpercent is not None:
-        cmdArgs.extend(['-warnpercent', str(warnpercent)])
-    if hardwarn is not None:
-        cmdArgs.extend(['-hardwarn', str(hardwarn)])
-    if fail is not None:
-        cmdArgs.extend(['-fail', str(fail)])
-    if failpercent is not None:
-        cmdArgs.extend(['-failpercent', str(failpercent)])
-    if hardfail is not None:
-        cmdArgs.extend(['-hardfail', str(hardfail)])
-    if perceptual:
-        cmdArgs.extend(['-p'])
-    cmd = [imageDiff]
-    cmd.extend(cmdArgs)
-    cmd.extend([imagePath1, imagePath2])
+    cmd = [*_idiffArgs(fail, failpercent, hardfail, warn, warnpercent, hardwarn, perceptual), 
+           imagePath1, imagePath2]
     
     if verbose:
-        import sys
         sys.__stdout__.write("\nimage diffing with {0}".format(cmd))
         sys.__stdout__.flush()
 
-    # LD_LIBRARY_PATH(or PATH or DYLD_LIBRARY_PATH) needs to be set for the idiff executable because its 
-    # RPATH is absolute rather than relative to ORIGIN, meaning the RPATH 
-    # points to the absolute path on the machine where idiff was built.
-    # This absence of relative paths for RPATH comes from OpenImageIO.
-    # We introduce a second workaround to avoid Maya using usd's libpng, 
-    # because both use incompatible versions of libpng. This is done by 
-    # setting LD_LIBRARY_PATH to IDIFF_LD_LIBRARY_PATH only when we run 
-    # idiff using Python's subprocess module.
-
-    if sys.platform == "darwin":
-        os.environ["DYLD_LIBRARY_PATH"] = os.environ['IDIFF_LD_LIBRARY_PATH']
-    elif sys.platform.startswith("linux"):
-        os.environ["LD_LIBRARY_PATH"] = os.environ['IDIFF_LD_LIBRARY_PATH']
-    
     # Run idiff command
-    proc = subprocess.run(cmd, shell=False, env=os.environ.copy(), stdout=subprocess.PIPE)
+    proc = subprocess.run(cmd, shell=False, env=_idiffEnv(), stdout=subprocess.PIPE)
     return proc
 
 class ImageDiffingTestCase:
     '''Mixin class for unit tests that require image comparison.'''
 
+    # When enabled, snapshot comparisons are run on a worker pool while the test
+    # keeps going, and their failures are reported when the test is torn down.
+    # assertSnapshotClose then returns None instead of the return code and never fails
+    # by itself, so it can't be used with assertRaises in such test cases.
+    # Deferred snapshots get a per-test counter suffix, so that snapshotting the same reference
+    # twice doesn't overwrite an image a worker may still be reading.
+    _deferImageDiffs = False
+
+    # Maximum number of snapshot comparisons running at the same time when deferred.
+    _maxDeferredImageDiffs = 4
+
+    # Set up per test in setUp. These defaults make test cases whose setUp doesn't call
+    # super() still snapshot, with their comparisons run synchronously.
+    _diffExecutor = None
+    _snapDir = None
+    _snapDirCreated = False
+
+    def setUp(self):
+        super(ImageDiffingTestCase, self).setUp()
+        self._pendingDiffs = []
+        self._snapshotCount = 0
+        self._diffExecutor = ThreadPoolExecutor(max_workers=self._maxDeferredImageDiffs) if self._deferImageDiffs else None
+        # Only created by the first snapshot, so that tests which don't snapshot leave no empty directory
+        self._snapDir = os.path.join(os.path.abspath('.'), self._testMethodName)
+        self._snapDirCreated = False
+
+    def tearDown(self):
+        try:
+            self.flushImageDiffs()
+        finally:
+            super(ImageDiffingTestCase, self).tearDown()
+
+    def flushImageDiffs(self):
+        '''Waits for the deferred snapshot comparisons and fails if any of them failed.'''
+        if self._diffExecutor is None:
+            return
+        pendingDiffs, self._pendingDiffs = self._pendingDiffs, []
+        failures = []
+        try:
+            for refImage, snapImage, thresholds, future in pendingDiffs:
+                proc = future.result()
+                if proc.returncode not in (0, 1):
+                    failures.append("Snapshot {0} differs from reference {1} (return code {2}, {3}):\n{4}"
+                                    .format(snapImage, refImage, proc.returncode, thresholds, proc.stdout))
+        finally:
+            self._diffExecutor.shutdown()
+            self._diffExecutor = None
+        if failures:
+            self.fail("\n".join(failures))
+
     def assertImagesClose(self, imagePath1, imagePath2, fail, failpercent, hardfail=None,
                     warn=None, warnpercent=None, hardwarn=None, perceptual=False):
         """ 
@@ -214,14 +376,10 @@ class ImageDiffingTestCase:
         3 -- The images were not the same size and could not be compared.
         4 -- File error: could not find or open input files, etc.
         """
-        #Disable undo
-        cmds.undoInfo(stateWithoutFlush=False)
         proc = imageDiff(imagePath1, imagePath2, verbose=True, 
                             fail=fail, failpercent=failpercent, hardfail=hardfail,
                             warn=warn, warnpercent=warnpercent, hardwarn=hardwarn, 
                             perceptual=perceptual)
-        #Enable undo again
-        cmds.undoInfo(stateWithoutFlush=True)
         if proc.returncode not in (0, 1):
             self.fail(str(proc.stdout))
         return proc.returncode
@@ -229,18 +387,54 @@ class ImageDiffingTestCase:
     def assertImagesEqual(self, imagePath1, imagePath2):
         self.assertImagesClose(imagePath1, imagePath2, fail=None, failpercent=None)
     
+    def _snapshotPath(self, refImage):
+        '''Returns the path of the snapshot compared to refImage, unique within the test when deferred.'''
+        snapName = os.path.basename(refImage)
+        if self._diffExecutor is not None:
+            self._snapshotCount += 1
+            name, ext = os.path.splitext(snapName)
+            snapName = '{0}_{1}{2}'.format(name, self._snapshotCount, ext)
+        if self._snapDir is None:
+            self._snapDir = os.path.join(os.path.abspath('.'), self._testMethodName)
+        if not self._snapDirCreated:
+            os.makedirs(self._snapDir, exist_ok=True)
+            self._snapDirCreated = True
+        return os.path.join(self._snapDir, snapName)
+
     def assertSnapshotClose(self, refImage, fail, failpercent, hardfail=None, 
                 warn=None, warnpercent=None, hardwarn=None, perceptual=False):
-        #Disable undo so that when we call undo it doesn't undo any operation from self.assertSnapshotClose
-        cmds.undoInfo(stateWithoutFlush=False)
-        snapDir = os.path.join(os.path.abspath('.'), self._testMethodName)
-        if not os.path.isdir(snapDir):
-            os.makedirs(snapDir)
-        snapImage = os.path.join(snapDir, os.path.basename(refImage))
-        snapshot(snapImage)
-        #Enable undo again
-        cmds.undoInfo(stateWithoutFlush=True)
-        
+        """ 
+        Snapshots the viewport and compares it to refImage, see assertImagesClose.
+        If _deferImageDiffs is enabled, the comparison is only checked in tearDown and None is returned.
+        """
+        snapImage = self._snapshotPath(refImage)
+        #Disable undo so that when we call undo it doesn't undo any operation from self.assertSnapshotClose.
+        #Only toggle it if it is enabled, so that tests running with undo disabled keep it that way.
+        undoWasEnabled = cmds.undoInfo(q=1, state=1)
+        if undoWasEnabled:
+            cmds.undoInfo(stateWithoutFlush=False)
+        try:
+            snapshot(snapImage)
+        finally:
+            if undoWasEnabled:
+                #Enable undo again
+                cmds.undoInfo(stateWithoutFlush=True)
+
+        if self._diffExecutor is not None:
+            # Compare while the test carries on, the result is checked in flushImageDiffs.
+            future = self._diffExecutor.submit(imageDiff, refImage, snapImage, verbose=True,
+                            fail=fail, failpercent=failpercent, hardfail=hardfail,
+                            warn=warn, warnpercent=warnpercent, hardwarn=hardwarn,
+                            perceptual=perceptual, 
+                            # The pool already runs comparisons in parallel, don't oversubscribe the cores
+                            nthreads=1)
+            thresholds = ', '.join('{0}={1}'.format(name, value) for name, value in 
+                                   (('fail', fail), ('failpercent', failpercent), ('hardfail', hardfail),
+                                    ('warn', warn), ('warnpercent', warnpercent), ('hardwarn', hardwarn),
+                                    ('perceptual', perceptual)) if value is not None)
+            self._pendingDiffs.append((refImage, snapImage, thresholds, future))
+            return None
+
         return self.assertImagesClose(refImage, snapImage, 
                fail=fail, failpercent=failpercent, hardfail=hardfail,
                warn=warn, warnpercent=warnpercent, hardwarn=hardwarn, 
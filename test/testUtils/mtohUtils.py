@@ -54,20 +54,25 @@ class MayaHydraBaseTestCase(unittest.TestCase):
         fixturesUtils.readOnlySetUpClass(cls._file, 'mayaHydra', 
                                          initializeStandalone=False)
 
-    def setHdStormRenderer(self):
+    def setRendererOverride(self, rendererOverrideName):
+        '''Sets the renderer override of the active editor and forces a refresh, returns False if it was already set.'''
         self.activeEditor = cmds.playblast(activeEditor=1)
-        cmds.modelEditor(
-            self.activeEditor, e=1,
-            rendererOverrideName=HD_STORM_OVERRIDE)
+        # Switching renderers rebuilds the scene delegate, so avoid it when there is nothing to switch
+        changed = cmds.modelEditor(self.activeEditor, q=1, rendererOverrideName=1) != rendererOverrideName
+        if changed:
+            cmds.modelEditor(self.activeEditor, e=1, rendererOverrideName=rendererOverrideName)
+        # Always refresh, callers rely on the scene being synced to the render index afterwards
         cmds.refresh(f=1)
+        return changed
+
+    def setHdStormRenderer(self):
+        self.setRendererOverride(HD_STORM_OVERRIDE)
         self.delegateId = cmds.mayaHydra(renderer=HD_STORM,
                                     sceneDelegateId="MayaHydraSceneDelegate")
         
     def setViewport2Renderer(self):
-        self.activeEditor = cmds.playblast(activeEditor=1)
         # Empty string for rendererOverrideName unsets any currently active override, thus returning to VP2
-        cmds.modelEditor(self.activeEditor, e=1, rendererOverrideName="")
-        cmds.refresh(f=1)
+        self.setRendererOverride("")
         self.delegateId = ""
 
     def setBasicCam(self, dist=DEFAULT_CAM_DIST):
@@ -125,7 +130,7 @@ class MayaHydraBaseTestCase(unittest.TestCase):
     def traceIndex(self, msg):
         self.trace(msg.format(str(self.getIndex())))
 
-class MtohTestCase(MayaHydraBaseTestCase, ImageDiffingTestCase):
+class MtohTestCase(ImageDiffingTestCase, MayaHydraBaseTestCase):
     '''Base class for mayaHydra unit tests with image comparison.'''
 
     _inputDir = None